@@ -10,74 +10,188 @@ AVISO LEGAL: Usa apenas dados/fotos com autorização. O scraping pode violar Te
 import asyncio
 import argparse
 import csv
+import functools
 import io
-import json
+import os
 import re
-import time
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
+import httpx
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from playwright.async_api import async_playwright
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
 from pptx.enum.shapes import MSO_SHAPE
 
+from json import loads as _std_json_loads
+
+try:
+    from orjson import loads as _orjson_loads  # opcional, mais rápido
+except ImportError:
+    _orjson_loads = None
+
+def json_loads(txt: str) -> Any:
+    # orjson é mais estrito (NaN/Infinity, inteiros > 64 bits); nesses casos usa o json da stdlib
+    if _orjson_loads is not None:
+        try:
+            return _orjson_loads(txt)
+        except ValueError:
+            pass
+    return _std_json_loads(txt)
+
 TEMPLATE_FILE = "template_hugosilva.pptx"
 
 # ---------------------------
 # Navegação com Playwright
 # ---------------------------
-async def fetch_html(url: str, render: str = "networkidle", timeout_ms: int = 45000) -> str:
-    from playwright.async_api import async_playwright
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(user_agent=(
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-        ))
-        page = await context.new_page()
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+)
+
+# Só precisamos do HTML (JSON-LD + DOM); estes recursos apenas atrasam o carregamento
+BLOCKED_RESOURCES = {"image", "media", "font", "stylesheet"}
+
+async def block_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def fetch_html(context, url: str, render: str = "domcontentloaded", timeout_ms: int = 45000) -> str:
+    page = await context.new_page()
+    try:
         await page.goto(url, wait_until=render, timeout=timeout_ms)
-        html = await page.content()
-        await browser.close()
-        return html
+        return await page.content()
+    finally:
+        await page.close()
 
 # ---------------------------
 # Parsing auxiliar
 # ---------------------------
+# Nós de texto do elemento, exceto dentro de <script>/<style> (que bs4 get_text também ignora)
+_XP_TEXT = etree.XPath(".//text()[not(ancestor::script or ancestor::style)]", smart_strings=False)
+
+def _text(el, sep: str = "") -> str:
+    # Equivalente a bs4 get_text(sep, strip=True) para elementos lxml
+    return sep.join(t.strip() for t in _XP_TEXT(el) if t.strip())
+
+# Árvore lxml memorizada por HTML: uma nova tentativa (ou segunda passagem) sobre a mesma
+# página não volta a fazer o parse. As árvores são só lidas, nunca alteradas.
+# etree.HTML devolve elementos lxml simples, sem as classes Python de lxml.html.
+_XML_DECL_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+@functools.lru_cache(maxsize=16)
+def _parse_tree(html: str):
+    # lxml recusa str com declaração de encoding; um documento sem elementos dá None
+    root = etree.HTML(_XML_DECL_RE.sub("", html, count=1))
+    return root if root is not None else etree.Element("html")
+
 def text_or_none(el) -> Optional[str]:
-    return el.get_text(strip=True) if el else None
+    return _text(el) if el is not None else None
+
+LABELS: Dict[str, List[str]] = {
+    "typology":  ["Tipologia"],
+    "bedrooms":  ["Quartos", "Nº de quartos", "Número de quartos"],
+    "bathrooms": ["Casas de banho", "WCs"],
+    "area":      ["Área bruta", "Área útil", "Área", "Área (m²)", "Área bruta (m²)"],
+}
+
+# Rótulo normalizado → campo; os rótulos são comparados por igualdade, não por regex
+_LABEL_KEYS: Dict[str, str] = {
+    label.lower(): key for key, labels in LABELS.items() for label in labels
+}
+
+def _label_key(txt: str) -> Optional[str]:
+    txt = txt.strip()
+    if txt.endswith(":"):
+        txt = txt[:-1]
+    return _LABEL_KEYS.get(txt.strip().lower())
+
+_PRECO_RE = re.compile("Preço", re.I)
+
+# Grupos de nós recolhidos numa única passagem pelo DOM (ordem do documento preservada)
+_BUCKETS: Dict[str, tuple] = {
+    "dt": ("dt",),
+    "li": ("li",),
+    "block": ("div", "span"),
+    "price": ("strong", "span"),
+    "h1": ("h1",),
+    "nav": ("nav",),
+    "p": ("p",),
+    "img": ("img",),
+    "script": ("script",),
+}
+_TAG_BUCKETS: Dict[str, List[str]] = defaultdict(list)
+for _name, _tags in _BUCKETS.items():
+    for _tag in _tags:
+        _TAG_BUCKETS[_tag].append(_name)
+
+def _collect(tree) -> Dict[str, list]:
+    buckets: Dict[str, list] = defaultdict(list)
+    for el in tree.iter(*_TAG_BUCKETS):
+        for name in _TAG_BUCKETS[el.tag]:
+            buckets[name].append(el)
+    return buckets
+
+_XP_NEXT_DD = etree.XPath("following::dd[1]")
+
+def _has_single_string(el) -> bool:
+    # Equivalente a bs4 `tag.string is not None`: um único nó filho de texto (ou comentário),
+    # diretamente ou através de uma cadeia de elementos com um só filho
+    while True:
+        children = list(el)
+        if not children:
+            return el.text is not None
+        if el.text is not None or len(children) > 1 or children[0].tail is not None:
+            return False
+        el = children[0]
+        if not isinstance(el.tag, str):
+            return True
 
-def find_label_value(soup: BeautifulSoup, labels: List[str]) -> Optional[str]:
-    label_pattern = re.compile(r"^\s*(%s)\s*:?$" % "|".join([re.escape(x) for x in labels]), re.I)
-    for dt in soup.find_all("dt"):
-        if dt.string and label_pattern.match(dt.get_text(strip=True)):
-            dd = dt.find_next("dd")
+# Uma única passagem por dt, li e div/span resolve todos os campos de LABELS
+def find_label_values(nodes: Dict[str, list]) -> Dict[str, str]:
+    found: Dict[str, str] = {}
+    for dt in nodes["dt"]:
+        if not _has_single_string(dt):
+            continue
+        key = _label_key(_text(dt))
+        if key and key not in found:
+            dd = _XP_NEXT_DD(dt)
             if dd:
-                return dd.get_text(" ", strip=True)
-    for li in soup.find_all("li"):
-        strong = li.find(["strong", "span"])
-        if strong and label_pattern.match(strong.get_text(strip=True)):
-            txt = li.get_text(" ", strip=True)
-            lab = strong.get_text(strip=True)
-            val = txt.replace(lab, "").strip(" :\u00a0-")
+                found[key] = _text(dd[0], " ")
+    for li in nodes["li"]:
+        strong = next(li.iter("strong", "span"), None)
+        if strong is None:
+            continue
+        lab = _text(strong)
+        key = _label_key(lab)
+        if key and key not in found:
+            val = _text(li, " ").replace(lab, "").strip(" :\u00a0-")
             if val:
-                return val
-    for node in soup.find_all(["div", "span"]):
-        if node.get_text(strip=True) and label_pattern.match(node.get_text(strip=True)):
-            sib = node.find_next_sibling()
-            if sib and sib.get_text(strip=True):
-                return sib.get_text(" ", strip=True)
-    return None
+                found[key] = val
+    for node in nodes["block"]:
+        key = _label_key(_text(node))
+        if key and key not in found:
+            sib = node.getnext()
+            while sib is not None and not isinstance(sib.tag, str):
+                sib = sib.getnext()
+            if sib is not None and _text(sib):
+                found[key] = _text(sib, " ")
+    return found
 
-def parse_json_ld(soup: BeautifulSoup) -> Dict[str, Any]:
+def parse_json_ld(scripts: list) -> Dict[str, Any]:
     data: Dict[str, Any] = {}
-    for tag in soup.find_all("script", type="application/ld+json"):
+    for tag in scripts:
+        if tag.get("type") != "application/ld+json":
+            continue
         try:
-            obj = json.loads(tag.string or "{}")
+            obj = json_loads(tag.text or "{}")
         except Exception:
             continue
         if isinstance(obj, list):
@@ -87,8 +201,12 @@ def parse_json_ld(soup: BeautifulSoup) -> Dict[str, Any]:
             _merge_realestate(data, obj)
     return data
 
+# Campos do JSON-LD de que precisamos; todos são first-wins, por isso quando estão preenchidos
+# nenhum nó seguinte os pode alterar e paramos de percorrer o @graph.
+_JSON_LD_FIELDS = ("title", "price", "price_str", "location", "description", "bedrooms")
+
 def _merge_realestate(dst: Dict[str, Any], obj: Dict[str, Any]):
-    if not isinstance(obj, dict):
+    if not isinstance(obj, dict) or all(dst.get(k) for k in _JSON_LD_FIELDS):
         return
     if "@graph" in obj and isinstance(obj["@graph"], list):
         for g in obj["@graph"]:
@@ -101,7 +219,7 @@ def _merge_realestate(dst: Dict[str, Any], obj: Dict[str, Any]):
         price = offer.get("price") or offer.get("lowPrice")
         dst.setdefault("price", price)
         currency = offer.get("priceCurrency")
-        if price and currency:
+        if price and currency and not dst.get("price_str"):
             dst["price_str"] = f"{price} {currency}"
     if isinstance(address, dict):
         loc = " ".join([
@@ -115,33 +233,113 @@ def _merge_realestate(dst: Dict[str, Any], obj: Dict[str, Any]):
     if rooms:
         dst.setdefault("bedrooms", str(rooms))
 
+# Imovirtual é uma app Next.js: o anúncio completo vem serializado em #__NEXT_DATA__
+_NEXT_DATA_RE = re.compile(r'<script[^>]*\bid="__NEXT_DATA__"[^>]*>(.*?)</script>', re.S)
+
+def _characteristic(ad: Dict[str, Any], *keys: str) -> Optional[str]:
+    for ch in ad.get("characteristics") or []:
+        if isinstance(ch, dict) and ch.get("key") in keys:
+            val = ch.get("localizedValue") or ch.get("value")
+            if val:
+                return str(val)
+    return None
+
+def _next_data_fields(ad: Dict[str, Any]) -> Dict[str, Any]:
+    location = ad.get("location")
+    address = location.get("address") if isinstance(location, dict) else None
+    places = []
+    for part in ("city", "county", "province"):
+        place = address.get(part) if isinstance(address, dict) else None
+        name = place.get("name") if isinstance(place, dict) else None
+        if isinstance(name, str) and name and name not in places:
+            places.append(name)
+    description = ad.get("description")
+    if not isinstance(description, str):
+        description = ""
+    if "<" in description:
+        root = etree.HTML(description)  # None quando o fragmento não tem elementos
+        description = _text(root, " ") if root is not None else ""
+    images = []
+    for img in ad.get("images") or []:
+        src = (img.get("large") or img.get("medium")) if isinstance(img, dict) else img
+        if isinstance(src, str) and src.startswith("http"):
+            images.append(src)
+    title = ad.get("title")
+    return {
+        "title": title if isinstance(title, str) else None,
+        "price_str": _characteristic(ad, "price"),
+        "location": ", ".join(places),
+        "area": _characteristic(ad, "m", "area"),
+        "typology": _characteristic(ad, "typology"),
+        "bedrooms": _characteristic(ad, "rooms_num"),
+        "bathrooms": _characteristic(ad, "bathrooms_num"),
+        "description": description,
+        "images": images,
+    }
+
+# Caminho opcional: qualquer surpresa no formato devolve {} e o parser HTML trata a página
+def parse_next_data(html: str) -> Dict[str, Any]:
+    m = _NEXT_DATA_RE.search(html)
+    if not m:
+        return {}
+    try:
+        ad = json_loads(m.group(1))["props"]["pageProps"]["ad"]
+        if not isinstance(ad, dict):
+            return {}
+        return _next_data_fields(ad)
+    except Exception:
+        return {}
+
 # ---------------------------
 # Parser principal
 # ---------------------------
+def _record(url: str, title, price, location, area, typology, bedrooms, bathrooms,
+            description, images: List[str]) -> Dict[str, Any]:
+    rec: Dict[str, Any] = {
+        "url": url,
+        "title": (title or "").strip(),
+        "price": (price or "").strip(),
+        "location": (location or "").strip(),
+        "area": (area or "").strip(),
+        "typology": (typology or "").strip(),
+        "bedrooms": (str(bedrooms) if bedrooms else "").strip(),
+        "bathrooms": (str(bathrooms) if bathrooms else "").strip(),
+        "description": (description or "").strip(),
+    }
+    for i, src in enumerate(images, start=1):
+        rec[f"image{i}"] = src
+    return rec
+
 def parse_listing(html: str, url: str, max_images: int = 3) -> Dict[str, Any]:
-    soup = BeautifulSoup(html, "lxml")
-    meta = parse_json_ld(soup)
-    title = meta.get("title") or text_or_none(soup.find("h1"))
+    # Caminho rápido: dados estruturados do Next.js, sem percorrer o DOM
+    ad = parse_next_data(html)
+    if ad.get("title") and ad.get("price_str"):
+        return _record(url, ad["title"], ad["price_str"], ad["location"], ad["area"], ad["typology"],
+                       ad["bedrooms"], ad["bathrooms"], ad["description"], ad["images"][:max_images])
+
+    tree = _parse_tree(html)
+    nodes = _collect(tree)
+    meta = parse_json_ld(nodes["script"])
+    title = meta.get("title") or text_or_none(next(iter(nodes["h1"]), None))
     price = meta.get("price")
     price_str = meta.get("price_str")
     if not price_str:
-        price_el = soup.find(["strong", "span"], attrs={"aria-label": re.compile("Preço", re.I)})
+        price_el = next((el for el in nodes["price"] if _PRECO_RE.search(el.get("aria-label") or "")), None)
         price_str = text_or_none(price_el) or (str(price) if price else "")
     location = meta.get("location") or ""
     if not location:
-        breadcrumb = soup.select_one("nav[aria-label='breadcrumb']")
+        breadcrumb = next((el for el in nodes["nav"] if el.get("aria-label") == "breadcrumb"), None)
         location = text_or_none(breadcrumb) or ""
-    typology   = find_label_value(soup, ["Tipologia"])
-    bedrooms   = meta.get("bedrooms") or find_label_value(soup, ["Quartos", "Nº de quartos", "Número de quartos"])
-    bathrooms  = find_label_value(soup, ["Casas de banho", "WCs"])
-    area       = find_label_value(soup, ["Área bruta", "Área útil", "Área", "Área (m²)", "Área bruta (m²)"])
+    labels     = find_label_values(nodes)
+    typology   = labels.get("typology")
+    bedrooms   = meta.get("bedrooms") or labels.get("bedrooms")
+    bathrooms  = labels.get("bathrooms")
+    area       = labels.get("area")
     description = meta.get("description")
     if not description:
-        paragraphs = [p.get_text(" ", strip=True) for p in soup.find_all("p")]
-        paragraphs.sort(key=len, reverse=True)
-        description = paragraphs[0] if paragraphs else ""
+        description = max((_text(p, " ") for p in nodes["p"]), key=len, default="")
     images: List[str] = []
-    for img in soup.find_all("img"):
+    for img in nodes["img"]:
         src = img.get("src") or img.get("data-src") or img.get("data-lazy")
         if not src:
             continue
@@ -151,20 +349,50 @@ def parse_listing(html: str, url: str, max_images: int = 3) -> Dict[str, Any]:
             images.append(src)
         if len(images) >= max_images:
             break
-    rec: Dict[str, Any] = {
-        "url": url,
-        "title": (title or "").strip(),
-        "price": (price_str or "").strip(),
-        "location": (location or "").strip(),
-        "area": (area or "").strip(),
-        "typology": (typology or "").strip(),
-        "bedrooms": (str(bedrooms) if bedrooms else "").strip(),
-        "bathrooms": (str(bathrooms) if bathrooms else "").strip(),
-        "description": (description or "").strip(),
-    }
-    for i, src in enumerate(images, start=1):
-        rec[f"image{i}"] = src
-    return rec
+    return _record(url, title, price_str, location, area, typology, bedrooms, bathrooms,
+                   description, images)
+
+# ---------------------------
+# Download de imagens
+# ---------------------------
+MAX_IMAGE_BYTES = 2_000_000
+
+async def _fetch_image_bytes(client: httpx.AsyncClient, sem: asyncio.Semaphore, url: str) -> bytes:
+    async with sem, client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        if int(resp.headers.get("content-length") or 0) > MAX_IMAGE_BYTES:
+            raise ValueError(f"imagem demasiado grande ({resp.headers['content-length']} bytes)")
+        buf = io.BytesIO()
+        async for chunk in resp.aiter_bytes(65536):
+            buf.write(chunk)
+            if buf.tell() > MAX_IMAGE_BYTES:
+                raise ValueError(f"imagem demasiado grande (> {MAX_IMAGE_BYTES} bytes)")
+        return buf.getvalue()
+
+# Descarrega todas as imagens do DataFrame em paralelo; devolve {url: bytes}
+async def _prefetch_images(df: pd.DataFrame, max_images: int = 3, concurrency: int = 20,
+                           timeout: float = 12) -> Dict[str, bytes]:
+    urls = []
+    for _, r in df.iterrows():
+        for i in range(1, max_images+1):
+            if r.get(f"image{i}"):
+                urls.append(r[f"image{i}"])
+    urls = list(dict.fromkeys(urls))
+
+    sem = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(http2=True, timeout=timeout, follow_redirects=True,
+                                 headers={"User-Agent": USER_AGENT},
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        results = await asyncio.gather(*[_fetch_image_bytes(client, sem, u) for u in urls],
+                                       return_exceptions=True)
+
+    cache: Dict[str, bytes] = {}
+    for url, res in zip(urls, results):
+        if isinstance(res, Exception):
+            print(f"[AVISO] imagem {url}: {res!r}")
+        else:
+            cache[url] = res
+    return cache
 
 # ---------------------------
 # PowerPoint helpers
@@ -186,7 +414,9 @@ def add_textbox(slide, left, top, width, height, text, font_size=14, color=None)
     tf.paragraphs[0].alignment = PP_ALIGN.LEFT
     return tb
 
-def build_pptx(df: pd.DataFrame, out_path: Path, brand: str, max_images: int = 3):
+async def build_pptx(df: pd.DataFrame, out_path: Path, brand: str, max_images: int = 3):
+    images = await _prefetch_images(df, max_images)
+
     # Load template if present
     if Path(TEMPLATE_FILE).exists():
         prs = Presentation(TEMPLATE_FILE)
@@ -230,50 +460,78 @@ def build_pptx(df: pd.DataFrame, out_path: Path, brand: str, max_images: int = 3
         col = 0
         for i in range(1, max_images+1):
             key = f"image{i}"
-            if not r.get(key): 
+            img_bytes = images.get(r.get(key))
+            if img_bytes is None:
                 continue
             try:
-                img_bytes = requests.get(r[key], timeout=12).content
                 s.shapes.add_picture(io.BytesIO(img_bytes), Inches(6.3), Inches(1.8 + col*2.0), width=Inches(3.0))
                 col += 1
             except Exception:
                 pass
 
-    prs.save(out_path)
+    # Serializa em memória e substitui o ficheiro de uma vez (sem PPTX meio escrito)
+    buf = io.BytesIO()
+    prs.save(buf)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    try:
+        tmp.write_bytes(buf.getvalue())
+        os.replace(tmp, out_path)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
 
 # ---------------------------
 # Main
 # ---------------------------
 async def run(args):
     df_urls = pd.read_csv(args.input)
-    rows = []
-    for _, row in df_urls.iterrows():
-        url = str(row["url"]).strip()
-        if not url or not url.startswith("http"):
-            continue
+    urls = [str(u).strip() for u in df_urls["url"]]
+    urls = [u for u in urls if u and u.startswith("http")]
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context(user_agent=USER_AGENT)
+        await context.route("**/*", block_resources)
+
+        async def bounded_fetch(url: str) -> Dict[str, Any]:
+            async with sem:
+                try:
+                    html = await fetch_html(context, url, render=args.render)
+                    # parse (CPU) numa thread para não bloquear os outros page.goto
+                    rec = await asyncio.to_thread(parse_listing, html, url, args.max_images)
+                    print(f"[OK] {url} → {rec.get('title','(sem título)')[:80]}")
+                    return rec
+                finally:
+                    await asyncio.sleep(args.delay)
+
         try:
-            html = await fetch_html(url, render=args.render)
-            rec = parse_listing(html, url, max_images=args.max_images)
-            rows.append(rec)
-            print(f"[OK] {url} → {rec.get('title','(sem título)')[:80]}")
-        except Exception as e:
-            print(f"[ERRO] {url}: {e}")
-        time.sleep(args.delay)
+            results = await asyncio.gather(*[bounded_fetch(url) for url in urls], return_exceptions=True)
+        finally:
+            await browser.close()
+
+    rows = []
+    errors = []
+    for url, res in zip(urls, results):
+        if isinstance(res, Exception):
+            errors.append((url, res))
+            print(f"[ERRO] {url}: {res}")
+        else:
+            rows.append(res)
+    if errors:
+        print(f"{len(errors)} de {len(urls)} URL(s) falharam.")
 
     if not rows:
         print("Nenhum registo extraído.")
         return
 
-    max_imgs = max([len([k for k in r.keys() if k.startswith("image")]) for r in rows])
-    for r in rows:
-        for i in range(1, max_imgs+1):
-            r.setdefault(f"image{i}", "")
-
+    # Colunas imageN em falta (anúncios com menos fotos) ficam vazias
+    df = pd.DataFrame(rows).fillna("")
     out_csv = Path(args.output)
-    pd.DataFrame(rows).to_csv(out_csv, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    df.to_csv(out_csv, index=False, quoting=csv.QUOTE_NONNUMERIC)
 
     out_pptx = Path(args.pptx)
-    build_pptx(pd.DataFrame(rows), out_pptx, brand=args.brand, max_images=args.max_images)
+    await build_pptx(df, out_pptx, brand=args.brand, max_images=args.max_images)
 
     print(f"Feito! CSV: {out_csv.resolve()} | PPTX: {out_pptx.resolve()}")
 
@@ -284,9 +542,10 @@ def parse_args():
     p.add_argument("--pptx", default="Apresentacoes_Imoveis.pptx", help="Nome do PowerPoint de saída")
     p.add_argument("--brand", default="Hugo Silva | Consultor Imobiliário · RE/MAX Oceanus — Choose your dream. Live in it.",
                    help="Assinatura/copy para a apresentação")
-    p.add_argument("--delay", type=float, default=2.0, help="Pausa (segundos) entre URLs")
+    p.add_argument("--delay", type=float, default=2.0, help="Pausa (segundos) entre URLs, por worker")
+    p.add_argument("--concurrency", type=int, default=4, help="Número de URLs a processar em paralelo")
     p.add_argument("--render", choices=["load", "domcontentloaded", "networkidle"],
-                   default="networkidle", help="Playwright wait_until")
+                   default="domcontentloaded", help="Playwright wait_until")
     p.add_argument("--max-images", type=int, default=3, help="Máximo de imagens por imóvel")
     return p.parse_args()
 